@@ -1,27 +1,38 @@
 #!/usr/bin/env python3
 import os
+import errno
 import atexit
 import shutil
 import asyncio
+import inspect
+import threading
+import aiofiles
 import tempfile
-import requests
-import subprocess
-from result import Err, Ok, Result, is_err
-from typing import List, Dict
+import httpx
+from contextlib import asynccontextmanager, contextmanager, suppress
+from result import Err, Ok, Result, is_err, is_ok
+from enum import Enum
+from typing import Annotated, List, Dict
 from pydantic import BaseModel
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-def ser2net_cmd(tty_path: str, speed: int, port: int) -> Result[List[str], str]:
-    ser2net_bin = shutil.which("ser2net")
-    if ser2net_bin is None:
-        if os.path.isfile("/usr/sbin/ser2net"):
-            ser2net_bin = "/usr/sbin/ser2net"
+def find_bin(name: str) -> str | None:
+    bin_path = shutil.which(name)
+    if bin_path is None and os.path.isfile(f"/usr/sbin/{name}"):
+        bin_path = f"/usr/sbin/{name}"
+
+    return bin_path
+
+# The binaries don't move while we are running, so only search $PATH once.
+SER2NET_BIN = find_bin("ser2net")
+DNSMASQ_BIN = find_bin("dnsmasq")
 
-        if ser2net_bin is None:
-            return Err("ser2net binary not found")
+def ser2net_cmd(tty_path: str, speed: int, port: int) -> Result[List[str], str]:
+    if SER2NET_BIN is None:
+        return Err("ser2net binary not found")
 
     return Ok([
-        ser2net_bin,
+        SER2NET_BIN,
         "-d",
         "-n",
         "-Y",
@@ -34,60 +45,180 @@ def ser2net_cmd(tty_path: str, speed: int, port: int) -> Result[List[str], str]:
         "    max-connections: 10",
     ])
 
-def ser2net_start(tty_path: str, speed: int, port: int) -> Result[subprocess.Popen, str]:
+async def tcp_port_accepts(port: int) -> bool:
+    # Note that each accepted connection makes ser2net open the serial
+    # device, so DTR/RTS toggle on every successful poll.
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout=0.05)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    writer.close()
+    with suppress(OSError):
+        await writer.wait_closed()
+    return True
+
+async def subprocess_wait_ready(name: str, child: asyncio.subprocess.Process, probe, timeout: float = 2.0, grace: float = 0.25) -> Result[None, str]:
+    # Poll the probe until the child answers, instead of sleeping a fixed
+    # time and hoping it is up by then.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        if child.returncode is not None:
+            return Err(f"{name} exited immediately")
+
+        if await probe():
+            # The probe may have been answered by a leftover process holding
+            # the port, in which case the child fails to bind and exits. Give
+            # it a short grace period to do so before reporting success.
+            try:
+                await asyncio.wait_for(child.wait(), timeout=grace)
+                return Err(f"{name} exited immediately")
+            except asyncio.TimeoutError:
+                return Ok(None)
+
+        if loop.time() >= deadline:
+            return Err(f"{name} did not become ready within {timeout}s")
+
+        await asyncio.sleep(0.01)
+
+async def ser2net_start(tty_path: str, speed: int, port: int) -> Result[asyncio.subprocess.Process, str]:
     cmd = ser2net_cmd(tty_path, speed, port)
     if is_err(cmd):
-        raise cmd
+        return cmd
 
-    child = subprocess.Popen(cmd.unwrap())
+    child = await asyncio.create_subprocess_exec(*cmd.unwrap())
 
     try:
-        child.wait(timeout=0.5)
-        return Err(f"ser2net for {cmd[0]} exited immediately")
-    except subprocess.TimeoutExpired:
-        # good, ser2net didn't exit immediately
-        pass
+        ready_result = await subprocess_wait_ready(f"ser2net for {tty_path}", child, lambda: tcp_port_accepts(port))
+    except BaseException:
+        await subprocess_end([child])
+        raise
+    if is_err(ready_result):
+        await subprocess_end([child])
+        return ready_result
 
     return Ok(child)
 
-def subprocess_end(child: subprocess.Popen) -> Result[None, str]:
-    child.terminate()
-    child.wait()
+async def subprocess_end(children: List[asyncio.subprocess.Process], timeout: float = 3.0) -> Result[None, str]:
+    # Signal all children first, so they shut down in parallel, and only
+    # escalate to SIGKILL for the ones still running after the timeout.
+    for child in children:
+        if child.returncode is None:
+            with suppress(ProcessLookupError):
+                child.terminate()
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*(child.wait() for child in children)), timeout)
+    except asyncio.TimeoutError:
+        for child in children:
+            if child.returncode is None:
+                with suppress(ProcessLookupError):
+                    child.kill()
+
+        await asyncio.gather(*(child.wait() for child in children))
+
     return Ok(None)
 
+def subprocess_watch(name: str, child: asyncio.subprocess.Process) -> asyncio.Task:
+    async def watch():
+        returncode = await child.wait()
+        print(f"{name} (PID {child.pid}) exited unexpectedly with code {returncode}")
+
+    return asyncio.create_task(watch())
+
 @dataclass
 class TFTPInstance:
     iface: str
     tftp_dir: str
-    process: subprocess.Popen
+    process: asyncio.subprocess.Process
+
+def dnsmasq_tftp_command(iface: str, tmp_dir: str) -> Result[List[str], str]:
+    if DNSMASQ_BIN is None:
+        return Err("dnsmasq binary not found")
+
+    return Ok([DNSMASQ_BIN,
+               "--no-daemon",
+               "--port=0",
+               "--interface=" + iface,
+               "--enable-tftp",
+               "--tftp-root=" + tmp_dir])
+
+class TFTPProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.reply = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data: bytes, addr):
+        if not self.reply.done():
+            self.reply.set_result(data)
+
+# Read request for a file that doesn't exist, answered with a TFTP error.
+TFTP_PROBE_RRQ = b"\x00\x01rtf-readiness-probe\x00octet\x00"
+
+async def tftp_server_responds() -> bool:
+    # dnsmasq always serves on lo in addition to the --interface given.
+    # Replies come from a new port (TID), so don't connect the socket.
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(TFTPProbeProtocol, local_addr=("127.0.0.1", 0))
+    try:
+        transport.sendto(TFTP_PROBE_RRQ, ("127.0.0.1", 69))
+        await asyncio.wait_for(protocol.reply, timeout=0.05)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        transport.close()
 
-def dnsmasq_tftp_command(iface: str, tmp_dir: str) -> List[str]:
-    return ["dnsmasq",
-            "--no-daemon",
-            "--port=0",
-            "--interface=" + iface,
-            "--enable-tftp",
-            "--tftp-root=" + tmp_dir]
+    return True
 
-def dnsmasq_tftp_start(iface: str) -> Result[TFTPInstance, str]:
+async def dnsmasq_tftp_start(iface: str) -> Result[TFTPInstance, str]:
     # create temp dir for tftpboot with random dirname
     tftp_dir = tempfile.mkdtemp(prefix="tftp-")
 
     cmd = dnsmasq_tftp_command(iface, tftp_dir)
-    child = subprocess.Popen(cmd)
+    if is_err(cmd):
+        return cmd
+
+    child = await asyncio.create_subprocess_exec(*cmd.unwrap())
 
     try:
-        child.wait(timeout=0.5)
-        return Err(f"dnsmasq for {iface} exited immediately")
-    except subprocess.TimeoutExpired:
-        # good, dnsmasq didn't exit immediately
-        pass
+        ready_result = await subprocess_wait_ready(f"dnsmasq for {iface}", child, tftp_server_responds)
+    except BaseException:
+        await subprocess_end([child])
+        raise
+    if is_err(ready_result):
+        await subprocess_end([child])
+        return ready_result
 
     return Ok(TFTPInstance(process=child, tftp_dir=tftp_dir, iface=iface))
 
-def tftp_provide_file(tftp_dir: str, filename: str, content: bytes) -> Result[None, str]:
-    with open(os.path.join(tftp_dir, filename), "wb") as f:
-        f.write(content)
+http_client = httpx.AsyncClient(timeout=60)
+
+async def tftp_download_to_file(tftp_dir: str, filename: str, url: str) -> Result[None, str]:
+    # Stream the download straight into the tftp dir instead of buffering
+    # the whole firmware image in memory first. Both the download and the
+    # file writes are awaited, so other requests are served meanwhile.
+    # Firmware images don't compress well, so ask for them as-is and skip
+    # the content decoder.
+    # dnsmasq serves whatever is at the target path, so download into a
+    # temporary file next to it and only move it into place once complete.
+    fd, tmp_path = tempfile.mkstemp(dir=tftp_dir, prefix=f".{filename}.")
+    # mkstemp creates the file 0600, but dnsmasq reads it as an unprivileged user
+    os.fchmod(fd, 0o644)
+    os.close(fd)
+    try:
+        async with http_client.stream("GET", url, headers={"Accept-Encoding": "identity"}) as response:
+            response.raise_for_status()
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in response.aiter_bytes(1024 * 1024):
+                    await f.write(chunk)
+
+        os.replace(tmp_path, os.path.join(tftp_dir, filename))
+    except (httpx.HTTPError, httpx.InvalidURL, httpx.StreamError) as e:
+        os.unlink(tmp_path)
+        return Err(str(e))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
     return Ok(None)
 
@@ -105,46 +236,37 @@ def file_set_contents(path: str, value: str) -> Result[None, str]:
 
     return Ok(None)
 
-
-def download_file(url: str) -> Result[bytes, str]:
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return Ok(response.content)
-    except requests.exceptions.RequestException as e:
-        return Err(str(e))
-
-from pyroute2 import IPRoute
+from pyroute2 import IPRoute, NetlinkError
 
 def iface_set_static_ip(interface: str, ip_address: str, mask: int = 24) -> Result[None, str]:
+    # Every request is ACKed by the kernel and pyroute2 raises on a failed
+    # ACK, so there is no need to read the addresses back to verify.
     with IPRoute() as ip:
         try:
             idx = ip.link_lookup(ifname=interface)[0]
             ip.flush_addr(index=idx)
-
-            # Verify flush
-            addresses = ip.get_addr(index=idx)
-            if len(addresses) > 0:
-                return Err(f"Failed to flush IP addresses from iface {interface}")
-
             ip.addr('add', index=idx, address=ip_address, mask=mask)
-
-            # Verify set
-            addresses = ip.get_addr(index=idx)
-            assigned_ips = [entry.get('attrs', [])[0][1] for entry in addresses]
-            if ip_address in assigned_ips:
-                return Ok(None)
-            else:
-                return Err(f"Tried to add IP {ip_address} to iface {interface}, but it wasn't there afterwards.")
+            return Ok(None)
         except IndexError:
             return Err(f"Iface {interface} not found.")
         except PermissionError:
             return Err(f"Root rights are necessary to set ip on iface {interface}.")
+        except NetlinkError as e:
+            if e.code == errno.EPERM:
+                return Err(f"Root rights are necessary to set ip on iface {interface}.")
+            return Err(f"Failed to set IP {ip_address} on iface {interface}: {e}")
+
+# GPIOs which already have an open value fd. Toggling happens on that fd
+# only, so this is the single place the exported state is tracked.
+prepared_gpios: set[int] = set()
 
-def gpio_prepare_output(gpio: int, active_low: bool, gpio_name: str) -> Result[None, str]:
+def gpio_prepare_output(gpio: int, active_low: bool, gpio_name: str) -> Result[int, str]:
     export_file = "/sys/class/gpio/export"
     gpio_path = f"/sys/class/gpio/gpio{gpio}"
 
+    if gpio in prepared_gpios:
+        return Err(f"{gpio_name} gpio {gpio} is already in use.")
+
     if not os.path.exists(export_file):
         return Err("GPIO export file not found")
 
@@ -161,28 +283,46 @@ def gpio_prepare_output(gpio: int, active_low: bool, gpio_name: str) -> Result[N
 
     active_low_file_content = "1" if active_low else "0"
     active_low_result = file_set_contents(f"{gpio_path}/active_low", active_low_file_content)
+    if is_err(active_low_result):
+        return active_low_result
 
-    return active_low_result
+    value_fd_result = gpio_open_value(gpio_path, gpio_name)
+    if is_ok(value_fd_result):
+        prepared_gpios.add(gpio)
 
-def gpio_set_value(gpio: int, value: int) -> Result[None, str]:
-    gpio_path = f"/sys/class/gpio/gpio{gpio}"
-    if not os.path.isdir(gpio_path):
-        return Err(f"GPIO {gpio} not exported")
+    return value_fd_result
 
-    with open(f"{gpio_path}/value", "w") as f:
-        f.write(f"{value}\n")
+def gpio_open_value(gpio_path: str, gpio_name: str) -> Result[int, str]:
+    # Keep the value file open for the lifetime of the process, so toggling
+    # the GPIO is a single pwrite()/pread() instead of open/write/close.
+    try:
+        fd = os.open(f"{gpio_path}/value", os.O_RDWR)
+    except OSError as e:
+        return Err(f"{gpio_name} gpio value could not be opened: {e}")
+    atexit.register(os.close, fd)
 
-    return Ok(None)
+    return Ok(fd)
 
-def gpio_get_value(gpio: int) -> Result[int, str]:
-    gpio_path = f"/sys/class/gpio/gpio{gpio}"
-    if not os.path.isdir(gpio_path):
-        return Err(f"GPIO {gpio} not exported")
+GPIO_VALUE_LOW = b"0\n"
+GPIO_VALUE_HIGH = b"1\n"
+
+# The value accessors are on the request hot path, so they raise OSError
+# instead of wrapping every call in a Result.
+def gpio_set_value(fd: int, value: int) -> None:
+    os.pwrite(fd, GPIO_VALUE_HIGH if value else GPIO_VALUE_LOW, 0)
 
-    with open(f"{gpio_path}/value") as f:
-        return Ok(int(f.read().strip()))
+def gpio_get_value(fd: int) -> int:
+    return os.pread(fd, 2, 0)[0] - 0x30
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+async def sleep_until(deadline: float) -> None:
+    # asyncio may fire timers up to one clock resolution early, so keep
+    # sleeping until the loop clock has actually passed the deadline.
+    loop = asyncio.get_running_loop()
+    while (remaining := deadline - loop.time()) > 0:
+        await asyncio.sleep(remaining)
 
 @dataclass
 class Device:
@@ -191,23 +331,26 @@ class Device:
     def prepare(self) -> Result[None, str]:
         return Err("not implemented")
 
-    async def is_powered_on(self) -> Result[bool, str]:
-        return Err("not implemented")
+    def is_powered_on(self, force: bool = False) -> bool:
+        raise NotImplementedError("not implemented")
 
-    async def power_off(self) -> Result[None, str]:
-        return Err("not implemented")
+    def power_off(self) -> None:
+        raise NotImplementedError("not implemented")
 
-    async def power_on(self) -> Result[None, str]:
-        return Err("not implemented")
+    def power_on(self) -> None:
+        raise NotImplementedError("not implemented")
 
-    async def power_cycle(self) -> Result[None, str]:
-        return Err("not implemented")
+    async def power_cycle(self) -> None:
+        raise NotImplementedError("not implemented")
 
-    async def reset_button_push(self) -> Result[None, str]:
-        return Err("not implemented")
+    def reset_button_push(self) -> None:
+        raise NotImplementedError("not implemented")
 
-    async def reset_button_release(self) -> Result[None, str]:
-        return Err("not implemented")
+    def reset_button_release(self) -> None:
+        raise NotImplementedError("not implemented")
+
+    async def reset_button_pulse(self, duration: float) -> None:
+        raise NotImplementedError("not implemented")
 
 @dataclass
 class Device1(Device):
@@ -217,39 +360,135 @@ class Device1(Device):
     power_gpio_inverted: bool = False
     reset_gpio_inverted: bool = False
     tftp_instace: TFTPInstance | None = None
+    power_cycle_off_time: float = 1.0
+    _power_fd: int = field(default=-1, init=False, repr=False)
+    _reset_fd: int = field(default=-1, init=False, repr=False)
+    _power_state: bool = field(default=False, init=False, repr=False)
+    _power_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
 
     def prepare(self) -> Result[None, str]:
         power_gpio_prepare_result = gpio_prepare_output(self.power_gpio, self.power_gpio_inverted, "Power")
         if is_err(power_gpio_prepare_result):
             return power_gpio_prepare_result
+        self._power_fd = power_gpio_prepare_result.unwrap()
 
-        return gpio_prepare_output(self.reset_gpio, self.reset_gpio_inverted, "Reset")
-
-    async def is_powered_on(self) -> Result[bool, str]:
-        return gpio_get_value(self.power_gpio).map(lambda x: x == 1)
-
-    async def power_off(self) -> Result[None, str]:
-        return gpio_set_value(self.power_gpio, 0)
-
-    async def power_on(self) -> Result[None, str]:
-        return gpio_set_value(self.power_gpio, 1)
+        reset_gpio_prepare_result = gpio_prepare_output(self.reset_gpio, self.reset_gpio_inverted, "Reset")
+        if is_err(reset_gpio_prepare_result):
+            return reset_gpio_prepare_result
+        self._reset_fd = reset_gpio_prepare_result.unwrap()
 
-    async def power_cycle(self) -> Result[None, str]:
-        power_off_result = await self.power_off()
-        if is_err(power_off_result):
-            return power_off_result
-
-        await asyncio.sleep(1)
-
-        return await self.power_on()
-
-    async def reset_button_push(self) -> Result[None, str]:
-        return gpio_set_value(self.reset_gpio, 1)
-
-    async def reset_button_release(self) -> Result[None, str]:
-        return gpio_set_value(self.reset_gpio, 0)
+        try:
+            self._power_state = gpio_get_value(self._power_fd) == 1
+        except OSError as e:
+            return Err(f"Power gpio value could not be read: {e}")
+
+        return Ok(None)
+
+    def is_powered_on(self, force: bool = False) -> bool:
+        # Only we toggle the power gpio, so the last written value is the
+        # current one. force re-reads it from sysfs for diagnostics.
+        if force:
+            with self._power_lock:
+                self._power_state = gpio_get_value(self._power_fd) == 1
+
+        return self._power_state
+
+    # The gpio methods are plain functions, so the handlers calling them run
+    # in FastAPI's threadpool. The lock keeps the cached power state in line
+    # with the last write when requests race.
+    def power_off(self) -> None:
+        with self._power_lock:
+            gpio_set_value(self._power_fd, 0)
+            self._power_state = False
+
+    def power_on(self) -> None:
+        with self._power_lock:
+            gpio_set_value(self._power_fd, 1)
+            self._power_state = True
+
+    async def power_cycle(self) -> None:
+        await asyncio.to_thread(self.power_off)
+        await sleep_until(asyncio.get_running_loop().time() + self.power_cycle_off_time)
+        await asyncio.to_thread(self.power_on)
+
+    def reset_button_push(self) -> None:
+        gpio_set_value(self._reset_fd, 1)
+
+    def reset_button_release(self) -> None:
+        gpio_set_value(self._reset_fd, 0)
+
+    async def reset_button_pulse(self, duration: float) -> None:
+        await asyncio.to_thread(self.reset_button_push)
+        try:
+            await sleep_until(asyncio.get_running_loop().time() + duration)
+        finally:
+            # never leave the reset button pushed, even if we get cancelled
+            await asyncio.to_thread(self.reset_button_release)
+
+def ser2net_config(app: FastAPI) -> Result[tuple[str, int, int], str]:
+    # Set from the command line when run as a script. When the app is
+    # loaded by uvicorn or fastapi run, take the values from the environment.
+    tty_path = getattr(app.state, "tty_path", None) or os.environ.get("RTF_TTY_PATH")
+    speed = getattr(app.state, "speed", None) or os.environ.get("RTF_SPEED")
+    port = getattr(app.state, "port", None) or os.environ.get("RTF_PORT")
+    if tty_path is None or speed is None or port is None:
+        return Err("ser2net is not configured: run server.py <tty_path> <speed> <tcpport> "
+                   "or set RTF_TTY_PATH, RTF_SPEED and RTF_PORT")
 
-app = FastAPI()
+    try:
+        return Ok((tty_path, int(speed), int(port)))
+    except ValueError as e:
+        return Err(f"Invalid ser2net configuration: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    config = ser2net_config(app)
+    if is_err(config):
+        raise RuntimeError(config.unwrap_err())
+    tty_path, speed, port = config.unwrap()
+
+    children = []
+    watchers = []
+    try:
+        # Start both children concurrently, so their startup checks overlap.
+        # Collect exceptions instead of propagating the first one, so the
+        # child the other start already spawned still ends up in children.
+        ser2net, dnsmasq_tftp = await asyncio.gather(
+            ser2net_start(tty_path, speed, port),
+            dnsmasq_tftp_start(iface),
+            return_exceptions=True,
+        )
+        if isinstance(ser2net, Ok):
+            children.append(ser2net.unwrap())
+        if isinstance(dnsmasq_tftp, Ok):
+            children.append(dnsmasq_tftp.unwrap().process)
+
+        for result in (ser2net, dnsmasq_tftp):
+            if isinstance(result, BaseException):
+                raise result
+            if is_err(result):
+                raise RuntimeError(result.unwrap_err())
+
+        ser2net = ser2net.unwrap()
+        dnsmasq_tftp: TFTPInstance = dnsmasq_tftp.unwrap()
+        devices["device1"].tftp_instance = dnsmasq_tftp
+
+        print(f"ser2net started with PID {ser2net.pid}")
+        print(f"dnsmasq started with PID {dnsmasq_tftp.process.pid}")
+
+        watchers.append(subprocess_watch("ser2net", ser2net))
+        watchers.append(subprocess_watch("dnsmasq", dnsmasq_tftp.process))
+
+        yield
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+
+        await subprocess_end(children)
+
+        await http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 class DevicesListResult(BaseModel):
     device_names: List[str]
@@ -267,8 +506,9 @@ devices["device1"] = Device1(
 
 device_init_failed = False
 for device_name, device in devices.items():
-    if is_err(device.prepare()):
-        print(f"Failed to prepare device {device_name}: {device.prepare().unwrap_err()}")
+    prepare_result = device.prepare()
+    if is_err(prepare_result):
+        print(f"Failed to prepare device {device_name}: {prepare_result.unwrap_err()}")
         device_init_failed = True
 
 if device_init_failed:
@@ -281,97 +521,85 @@ if is_err(iface_set_ip_result):
     print(iface_set_ip_result.unwrap_err())
     exit(1)
 
-@app.get("/")
-async def list_devices() -> DevicesListResult:
-    return DevicesListResult(device_names=list(devices.keys()))
-
-@app.get("/{device_name}/power")
-async def device_power(device_name: str) -> str:
-    device = devices.get(device_name)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-
-    result = await device.is_powered_on()
-    if is_err(result):
-        raise HTTPException(status_code=500, detail=result.unwrap_err())
+# The device table is fixed at startup, so let FastAPI validate the device
+# name against it. Unknown devices are rejected with 422 before any
+# handler runs.
+DeviceName = Enum("DeviceName", {name: name for name in devices}, type=str)
 
-    return "on" if result.unwrap() else "off"
+def get_device(device_name: DeviceName) -> Device:
+    return devices[device_name]
 
-@app.post("/{device_name}/power/off")
-async def device_power_off(device_name: str) -> str:
-    device = devices.get(device_name)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+DeviceDep = Annotated[Device, Depends(get_device)]
 
-    result = await device.power_off()
+def check_result(result: Result):
     if is_err(result):
         raise HTTPException(status_code=500, detail=result.unwrap_err())
 
-    return "ok"
+    return result.unwrap()
 
-@app.post("/{device_name}/power/on")
-async def device_power_on(device_name: str) -> str:
-    device = devices.get(device_name)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+@contextmanager
+def device_errors():
+    try:
+        yield
+    except (OSError, NotImplementedError) as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-    result = await device.power_on()
-    if is_err(result):
-        raise HTTPException(status_code=500, detail=result.unwrap_err())
+@app.get("/")
+async def list_devices() -> DevicesListResult:
+    return DevicesListResult(device_names=list(devices.keys()))
 
-    return "ok"
+@app.get("/{device_name}/power", response_class=PlainTextResponse)
+def device_power(device: DeviceDep, force: bool = False) -> PlainTextResponse:
+    with device_errors():
+        powered_on = device.is_powered_on(force)
 
-@app.post("/{device_name}/power/cycle")
-async def device_power_cycle(device_name: str) -> str:
-    device = devices.get(device_name)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    return PlainTextResponse("on" if powered_on else "off")
 
-    result = await device.power_cycle()
-    if is_err(result):
-        raise HTTPException(status_code=500, detail=result.unwrap_err())
+def device_action_handler(method_name: str):
+    if inspect.iscoroutinefunction(getattr(Device, method_name)):
+        async def handler(device: DeviceDep) -> PlainTextResponse:
+            with device_errors():
+                await getattr(device, method_name)()
 
-    return "ok"
+            return PlainTextResponse("ok")
+    else:
+        # FastAPI runs plain def handlers in its threadpool, so a slow gpio
+        # write doesn't block the event loop.
+        def handler(device: DeviceDep) -> PlainTextResponse:
+            with device_errors():
+                getattr(device, method_name)()
 
-@app.post("/{device_name}/reset/push")
-async def device_push_reset_button(device_name: str) -> str:
-    device = devices.get(device_name)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+            return PlainTextResponse("ok")
 
-    result = await device.reset_button_push()
-    if is_err(result):
-        raise HTTPException(status_code=500, detail=result.unwrap_err())
+    handler.__name__ = f"device_{method_name}"
+    return handler
 
-    return "ok"
+device_actions = [
+    ("/power/off", "power_off"),
+    ("/power/on", "power_on"),
+    ("/power/cycle", "power_cycle"),
+    ("/reset/push", "reset_button_push"),
+    ("/reset/release", "reset_button_release"),
+]
 
-@app.post("/{device_name}/reset/release")
-async def device_release_reset_button(device_name: str) -> str:
-    device = devices.get(device_name)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+for path, method_name in device_actions:
+    app.post("/{device_name}" + path, response_class=PlainTextResponse)(device_action_handler(method_name))
 
-    result = await device.reset_button_release()
-    if is_err(result):
-        raise HTTPException(status_code=500, detail=result.unwrap_err())
-
-    return "ok"
+@app.post("/{device_name}/reset/pulse", response_class=PlainTextResponse)
+async def device_reset_button_pulse(device: DeviceDep, ms: Annotated[int, Query(ge=0, le=60000)] = 200) -> PlainTextResponse:
+    with device_errors():
+        await device.reset_button_pulse(ms / 1000)
 
-@app.post("/{device_name}/tftp-file")
-async def device_flash(device_name: str, from_url: str) -> str:
-    device = devices.get(device_name)
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    return PlainTextResponse("ok")
 
-    download_result = download_file(from_url)
-    if is_err(download_result):
-        raise HTTPException(status_code=500, detail=download_result.unwrap_err())
+@app.post("/{device_name}/tftp-file", response_class=PlainTextResponse)
+async def device_flash(device: DeviceDep, from_url: str) -> PlainTextResponse:
+    if device.tftp_instance.process.returncode is not None:
+        raise HTTPException(status_code=503, detail="dnsmasq is not running")
 
-    tftp_provide_result = tftp_provide_file(device.tftp_instance.tftp_dir, device.tftp_filename, download_result.unwrap())
-    if is_err(tftp_provide_result):
-        raise HTTPException(status_code=500, detail=tftp_provide_result.unwrap_err())
+    check_result(await tftp_download_to_file(device.tftp_instance.tftp_dir, device.tftp_filename, from_url))
 
-    return "ok"
+    return PlainTextResponse("ok")
 
 if __name__ == "__main__":
     import sys
@@ -379,30 +607,9 @@ if __name__ == "__main__":
         print(f"Usage: {sys.argv[0]} <tty_path> <speed> <tcpport>")
         sys.exit(1)
 
-    tty_path = sys.argv[1]
-    speed = int(sys.argv[2])
-    port = int(sys.argv[3])
-
-    ser2net = ser2net_start(tty_path, speed, port)
-    if is_err(ser2net):
-        print(ser2net)
-        sys.exit(1)
-
-    ser2net = ser2net.unwrap()
-    atexit.register(lambda: subprocess_end(ser2net))
-
-    dnsmasq_tftp = dnsmasq_tftp_start(iface)
-    if is_err(dnsmasq_tftp):
-        print(dnsmasq_tftp)
-        sys.exit(1)
-
-    dnsmasq_tftp: TFTPInstance = dnsmasq_tftp.unwrap()
-    atexit.register(lambda: subprocess_end(dnsmasq_tftp.process))
-
-    devices["device1"].tftp_instance = dnsmasq_tftp
-
-    print(f"ser2net started with PID {ser2net.pid}")
-    print(f"dnsmasq started with PID {dnsmasq_tftp.process.pid}")
+    app.state.tty_path = sys.argv[1]
+    app.state.speed = int(sys.argv[2])
+    app.state.port = int(sys.argv[3])
 
     import uvicorn
     uvicorn.run(app, host="127.0.0.1")